@@ -1,9 +1,18 @@
+import atexit
 import calendar
 import functools
+import heapq
+import multiprocessing
+import os
 import pickle
 import re
-from datetime import datetime
+import signal
+import threading
+import zlib
+from bisect import bisect_right
+from datetime import date, datetime
 from collections import UserDict
+from itertools import chain
 from typing import Callable
 
 from colorit import *
@@ -12,40 +21,224 @@ from prompt_toolkit import prompt
 
 import common
 from abstract_ui import UI
+from cache import query_cache
+from autosave import (
+    JOURNAL_LIMIT,
+    AutoSaver,
+    append_journal,
+    remove_journal,
+    replay_journal,
+    write_atomic,
+)
+from dedup import DuplicateIndex, find_clusters, merge_records
+from fuzzy import SUGGESTIONS_NUMBER, TrigramIndex, fuzzy_key
+from history import History
+from metrics import metrics, raised_inside
+from search import executor, split_limit
+
+
+SHARDS = int(os.environ.get("ADDRESSBOOK_SHARDS", "1"))
 
 
 class MyException(Exception):
     pass
 
 
+def user_not_found(suggestions: list[str]) -> MyException:
+    if suggestions:
+        return MyException(
+            f"This user isn't in the Book. Did you mean: {', '.join(suggestions)}?"
+        )
+    return MyException("This user isn't in the Book")
+
+
 class AddressBook(UserDict):
 
     index: str = 0
+    generation: int = 0
+
+    def __init__(self, *args, **kwargs):
+        self.name_index = TrigramIndex()
+        self.duplicate_index = DuplicateIndex()
+        self.birthday_cache = {}
+        self.birthday_cache_day = None
+        self.lock = threading.RLock()
+        self.dirty = set()
+        super().__init__(*args, **kwargs)
+        self.history = History()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("name_index", None)
+        state.pop("duplicate_index", None)
+        state.pop("birthday_cache", None)
+        state.pop("birthday_cache_day", None)
+        state.pop("lock", None)
+        state.pop("dirty", None)
+        return state
 
     def __getitem__(self, name):
         if not name in self.data.keys():
-            raise MyException("This user isn't in the Book")
+            raise user_not_found(self.suggest(name))
         user = self.data[name]
         return user
 
+    def __setitem__(self, name, record):
+        with self.lock:
+            self.data[name] = record
+            self.name_index.add(name)
+            self.duplicate_index.add(record)
+            self.birthday_cache.pop(name, None)
+            self.dirty.add(name)
+            self.generation += 1
+
     def add_record(self, record) -> str:
-        self.data.update({record.name.value: record})
+        with self.lock:
+            self.data.update({record.name.value: record})
+            self.name_index.add(record.name.value)
+            self.duplicate_index.add(record)
+            self.birthday_cache.pop(record.name.value, None)
+            self.dirty.add(record.name.value)
+            self.generation += 1
         return "Done!"
 
     def delete_record(self, name) -> str:
-        try:
-            self.data.pop(name)
-            return f"{name} was removed"
-        except KeyError:
-            return "This user isn't in the Book"
+        with self.lock:
+            try:
+                self.data.pop(name)
+                self.name_index.remove(name)
+                self.duplicate_index.remove(name)
+                self.birthday_cache.pop(name, None)
+                self.dirty.add(name)
+                self.generation += 1
+                return f"{name} was removed"
+            except KeyError:
+                return "This user isn't in the Book"
+
+    def rebuild_index(self) -> None:
+        self.name_index = TrigramIndex()
+        self.duplicate_index = DuplicateIndex()
+        self.birthday_cache = {}
+        for name, record in self.data.items():
+            self.name_index.add(name)
+            self.duplicate_index.add(record)
+
+    def duplicates_of(self, record) -> list[str]:
+        return sorted(self.duplicate_index.candidates(record))
+
+    def birthday_distance(self, name: str) -> int:
+        """Days to the user's birthday (None if unknown), cached until the local midnight or the record's change."""
+        today = date.today()
+        if today != self.birthday_cache_day:
+            self.birthday_cache = {}
+            self.birthday_cache_day = today
+        if name not in self.birthday_cache:
+            birthday = self.data[name].birthday
+            self.birthday_cache[name] = birthday.days_from(today) if birthday else None
+        return self.birthday_cache[name]
+
+    def birthdays_report(self) -> list[tuple[int, str]]:
+        """(days to birthday, name) of all the users with a known birthday, nearest first.
+
+        Sorted by bucketing the cached days, so it's O(N).
+        """
+        buckets = [[] for _ in range(366)]
+        for name in self.data.keys():
+            days = self.birthday_distance(name)
+            if days is not None:
+                buckets[days].append(name)
+        return [(days, name) for days, names in enumerate(buckets) for name in names]
+
+    def duplicate_entries(self) -> list:
+        return self.duplicate_index.entries()
+
+    def duplicate_clusters(self) -> list[list[str]]:
+        return find_clusters(self.duplicate_entries())
+
+    def replace_records(self, records: list, names_to_delete: list[str]) -> None:
+        for name in names_to_delete:
+            self.delete_record(name)
+        for record in records:
+            self.restore_record(record)
+
+    def find_record(self, name):
+        return self.data.get(name)
+
+    def rank(self, name: str) -> list[tuple[float, str]]:
+        return self.name_index.rank(name)
+
+    def suggest(self, name: str) -> list[str]:
+        return self.name_index.suggest(name)
+
+    def records_after(self, name, n: int) -> list:
+        names = sorted(self.data.keys())
+        start = 0 if name is None else bisect_right(names, name)
+        return [self.data[key] for key in names[start : start + n]]
+
+    def search(self, pattern: str, limit: int = None) -> list:
+        pattern = contact_pattern(pattern)
+        items = [
+            (name, (f"{name}|{'|'.join([phone.value for phone in record.phones])}",))
+            for name, record in self.data.items()
+        ]
+        return [self.data[name] for name in executor.search(items, pattern, limit=limit)]
 
     def get_contacts(self, file_name):
+        numbers = shard_numbers(file_name)
+        if numbers:
+            self.merge_shards(file_name, numbers)
+            return
         with open(file_name, "ab+") as fh:
             fh.seek(0)
             try:
-                self.data = pickle.load(fh)
+                book = pickle.load(fh)
             except EOFError:
-                pass
+                book = self.data
+        if isinstance(book, AddressBook):
+            self.history = book.__dict__.get("history", self.history)
+        while isinstance(book, UserDict):
+            book = book.data
+        with self.lock:
+            self.data = book
+            self.history = replay_journal(file_name, self.data, self.history)
+            self.history.resize()
+            self.dirty = set()
+            self.generation += 1
+            self.rebuild_index()
+
+    def merge_shards(self, file_name, numbers: list[int]) -> None:
+        """Loads the contacts saved by a ShardedAddressBook and saves them to file_name, so the shard files are retired."""
+        data = load_shards(file_name, numbers)
+        with self.lock:
+            self.data = data
+            self.history = load_history(file_name, self.history)
+            self.history.resize()
+            self.dirty = set()
+            self.generation += 1
+            self.rebuild_index()
+            self.write_contacts(file_name)
+        remove_shards(file_name, numbers)
+        for path in (shard_count_file(file_name), history_file(file_name)):
+            if os.path.exists(path):
+                os.remove(path)
+        remove_journal(history_file(file_name))
+
+    def restore_record(self, record) -> None:
+        self.add_record(record.copy())
+
+    def update_record(self, record, previous, description: str) -> None:
+        self.add_record(record)
+        self.history.record(
+            description,
+            ("restore_record", (previous,)),
+            ("restore_record", (record.copy(),)),
+        )
+
+    def undo(self) -> str:
+        return self.history.undo(self)
+
+    def redo(self) -> str:
+        return self.history.redo(self)
 
     def iterator(self, n=2):
         if len(self.data) > self.index:
@@ -66,8 +259,321 @@ class AddressBook(UserDict):
             return "the end"
 
     def write_contacts(self, file_name) -> None:
-        with open(file_name, "wb") as fh:
-            pickle.dump(self, fh)
+        with self.lock:
+            version = self.history.version
+            write_atomic(file_name, self)
+            remove_journal(file_name)
+            self.dirty = set()
+            self.history.forget_events(version)
+
+    def flush_changes(self, file_name) -> None:
+        """Appends only the changed records and the new history events to the journal of the file,
+        the whole file is rewritten when the journal grows too big."""
+        with self.lock:
+            if not self.dirty and not self.history.events:
+                return
+            names = set(self.dirty)
+            entry = pickle.dumps(
+                ({name: self.data.get(name) for name in names}, self.history.take_events())
+            )
+            journal_size = append_journal(file_name, entry)
+            self.dirty -= names
+            if journal_size > JOURNAL_LIMIT:
+                self.write_contacts(file_name)
+
+
+class ShardedAddressBook:
+    """AddressBook split by the normalized name between worker processes.
+
+    Every worker owns one shard and its file. Point lookups go to a single shard,
+    scans run on all the shards in parallel and their results are merged.
+    The history of the changes is kept by the coordinator.
+    The workers aren't daemonic, so they can run the search pools; they are stopped at exit.
+    """
+
+    def __init__(self, shards: int) -> None:
+        self.history = History()
+        self.history_version = self.history.version
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.cursor = None
+        self.connections = []
+        self.workers = []
+        for _ in range(shards):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=serve_shard, args=(worker_connection,)
+            )
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+        atexit.register(self.close)
+
+    def __contains__(self, name) -> bool:
+        return self.request(self.shard(name), "__contains__", name)
+
+    def __getitem__(self, name):
+        try:
+            return self.request(self.shard(name), "__getitem__", name)
+        except MyException:
+            raise user_not_found(self.suggest(name))
+
+    def __len__(self) -> int:
+        return sum(self.fan_out("__len__"))
+
+    def shard(self, name: str):
+        key = zlib.crc32(fuzzy_key(name).encode("utf-8"))
+        return self.connections[key % len(self.connections)]
+
+    def request(self, connection, method: str, *args):
+        with self.lock:
+            connection.send((method, args))
+            return receive(connection)
+
+    def fan_out(self, method: str, *args) -> list:
+        with self.lock:
+            for connection in self.connections:
+                connection.send((method, args))
+            return self.receive_all()
+
+    def fan_out_to_files(self, method: str, file_name: str) -> list:
+        with self.lock:
+            for number, connection in enumerate(self.connections):
+                connection.send((method, (shard_file(file_name, number),)))
+            return self.receive_all()
+
+    def receive_all(self) -> list:
+        """Reads the replies of all the shards before raising the first error, so no reply is left in a pipe."""
+        replies = [connection.recv() for connection in self.connections]
+        for success, result in replies:
+            if not success:
+                raise result
+        return [result for _, result in replies]
+
+    def add_record(self, record) -> str:
+        self.generation += 1
+        return self.request(self.shard(record.name.value), "add_record", record)
+
+    def delete_record(self, name) -> str:
+        self.generation += 1
+        return self.request(self.shard(name), "delete_record", name)
+
+    def find_record(self, name):
+        return self.request(self.shard(name), "find_record", name)
+
+    def restore_record(self, record) -> None:
+        self.generation += 1
+        self.request(self.shard(record.name.value), "restore_record", record)
+
+    def update_record(self, record, previous, description: str) -> None:
+        self.add_record(record)
+        self.history.record(
+            description,
+            ("restore_record", (previous,)),
+            ("restore_record", (record.copy(),)),
+        )
+
+    def undo(self) -> str:
+        return self.history.undo(self)
+
+    def redo(self) -> str:
+        return self.history.redo(self)
+
+    def duplicates_of(self, record) -> list[str]:
+        return sorted(chain(*self.fan_out("duplicates_of", record)))
+
+    def birthday_distance(self, name: str) -> int:
+        return self.request(self.shard(name), "birthday_distance", name)
+
+    def birthdays_report(self) -> list[tuple[int, str]]:
+        return list(heapq.merge(*self.fan_out("birthdays_report"), key=lambda item: item[0]))
+
+    def duplicate_clusters(self) -> list[list[str]]:
+        return find_clusters(chain(*self.fan_out("duplicate_entries")))
+
+    def replace_records(self, records: list, names_to_delete: list[str]) -> None:
+        for name in names_to_delete:
+            self.delete_record(name)
+        for record in records:
+            self.restore_record(record)
+
+    def suggest(self, name: str) -> list[str]:
+        ranked = heapq.nlargest(SUGGESTIONS_NUMBER, chain(*self.fan_out("rank", name)))
+        return [name for score, name in ranked]
+
+    def search(self, pattern: str, limit: int = None) -> list:
+        re.compile(contact_pattern(pattern))
+        return list(chain(*self.fan_out("search", pattern, limit)))[:limit]
+
+    def show_records(self, n=2):
+        batches = self.fan_out("records_after", self.cursor, n)
+        merged = heapq.merge(*batches, key=lambda record: record.name.value)
+        records = [record for record, _ in zip(merged, range(n))]
+        if not records:
+            self.cursor = None
+            return "the end"
+        self.cursor = records[-1].name.value
+        return "\n".join([record.show_record() for record in records])
+
+    def get_contacts(self, file_name):
+        """Loads the shard files. When they were saved with another number of shards, or there are none yet
+        and the contacts are in file_name, the records are partitioned again and file_name is retired.
+        """
+        self.generation += 1
+        numbers = shard_numbers(file_name)
+        shards = len(self.connections)
+        if numbers and read_pickle(shard_count_file(file_name), None) == shards:
+            self.fan_out_to_files("get_contacts", file_name)
+            self.history = load_history(file_name, self.history)
+            self.history.resize()
+            self.history_version = self.history.version
+        else:
+            if numbers:
+                data = load_shards(file_name, numbers)
+                self.history = load_history(file_name, self.history)
+            else:
+                book = AddressBook()
+                book.get_contacts(file_name)
+                data = book.data
+                self.history = book.history
+            self.history.resize()
+            self.history_version = None
+            partitions = [{} for _ in self.connections]
+            for name, record in data.items():
+                partitions[self.connections.index(self.shard(name))][name] = record
+            with self.lock:
+                for connection, records in zip(self.connections, partitions):
+                    connection.send(("update", (records,)))
+                self.receive_all()
+            self.write_contacts(file_name)
+            write_atomic(shard_count_file(file_name), shards)
+            remove_shards(file_name, [number for number in numbers if number >= shards])
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        remove_journal(file_name)
+
+    def write_history(self, file_name) -> None:
+        with self.lock:
+            version = self.history.version
+            if version != self.history_version:
+                write_atomic(history_file(file_name), self.history)
+                remove_journal(history_file(file_name))
+                self.history_version = version
+                self.history.forget_events(version)
+
+    def flush_history(self, file_name) -> None:
+        """Appends the new history events to the journal of the history file."""
+        with self.lock:
+            events = self.history.take_events()
+            if not events:
+                return
+            journal_size = append_journal(history_file(file_name), pickle.dumps(({}, events)))
+            if journal_size > JOURNAL_LIMIT:
+                self.write_history(file_name)
+
+    def write_contacts(self, file_name) -> None:
+        self.fan_out_to_files("write_contacts", file_name)
+        self.write_history(file_name)
+
+    def flush_changes(self, file_name) -> None:
+        self.fan_out_to_files("flush_changes", file_name)
+        self.flush_history(file_name)
+
+    def close(self) -> None:
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+            for worker in self.workers:
+                worker.join()
+            self.connections = []
+            self.workers = []
+
+
+def shard_file(file_name: str, number: int) -> str:
+    return f"{file_name}.shard{number}"
+
+
+def shard_count_file(file_name: str) -> str:
+    return f"{file_name}.shards"
+
+
+def history_file(file_name: str) -> str:
+    return f"{file_name}.history"
+
+
+def shard_numbers(file_name: str) -> list[int]:
+    """Numbers of the shards saved next to file_name, with a shard file or only its journal."""
+    folder, base = os.path.split(file_name)
+    pattern = re.compile(rf"{re.escape(base)}\.shard(\d+)(\.journal)?")
+    numbers = set()
+    for name in os.listdir(folder or "."):
+        match = pattern.fullmatch(name)
+        if match:
+            numbers.add(int(match.group(1)))
+    return sorted(numbers)
+
+
+def load_shards(file_name: str, numbers: list[int]) -> dict:
+    data = {}
+    for number in numbers:
+        shard = AddressBook()
+        shard.get_contacts(shard_file(file_name, number))
+        data.update(shard.data)
+    return data
+
+
+def remove_shards(file_name: str, numbers: list[int]) -> None:
+    for number in numbers:
+        path = shard_file(file_name, number)
+        if os.path.exists(path):
+            os.remove(path)
+        remove_journal(path)
+
+
+def load_history(file_name: str, history: History) -> History:
+    """Loads the history file of a sharded book and replays its journal."""
+    history = read_pickle(history_file(file_name), history)
+    return replay_journal(history_file(file_name), {}, history)
+
+
+def read_pickle(file_name: str, default):
+    try:
+        with open(file_name, "rb") as fh:
+            return pickle.load(fh)
+    except (FileNotFoundError, EOFError):
+        return default
+
+
+def contact_pattern(pattern: str) -> str:
+    return re.sub("\+", "\\+", pattern)
+
+
+def receive(connection):
+    success, result = connection.recv()
+    if not success:
+        raise result
+    return result
+
+
+def serve_shard(connection) -> None:
+    """Worker loop of a ShardedAddressBook: calls the requested AddressBook methods on its shard.
+
+    Ctrl-C reaches the whole process group, the worker ignores it, so the coordinator can still flush its shard.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    book = AddressBook()
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, args = message
+        try:
+            connection.send((True, getattr(book, method)(*args)))
+        except Exception as err:
+            connection.send((False, err))
 
 
 class Field:
@@ -79,6 +585,7 @@ class Field:
 class Birthday(Field):
     format: str = None
     formats = ["%d/%m", "%d/%m/%Y", "%d-%m", "%d-%m-%Y"]
+    month_day: tuple = None
 
     @property
     def value(self):
@@ -90,6 +597,7 @@ class Birthday(Field):
         if format != None:
             self.__value = birthday
             self.format = format
+            self.month_day = None
         else:
             raise ValueError(
                 f"The birthday wasn't added, it should be in one of the formats: {', '.join([f for f in Birthday.formats])}"
@@ -103,6 +611,26 @@ class Birthday(Field):
             except ValueError:
                 pass
 
+    def days_from(self, today: date) -> int:
+        """Days from today to the next birthday. Parses the date only once.
+
+        A 29th of February birthday is on the 28th in non-leap years.
+        """
+        if self.month_day is None:
+            parsed = datetime.strptime(self.value, self.format)
+            self.month_day = (parsed.month, parsed.day)
+        month, day = self.month_day
+        next_birthday = birthday_in_year(today.year, month, day)
+        if next_birthday < today:
+            next_birthday = birthday_in_year(today.year + 1, month, day)
+        return (next_birthday - today).days
+
+
+def birthday_in_year(year: int, month: int, day: int) -> date:
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        day = 28
+    return date(year, month, day)
+
 
 class Name(Field):
     pass
@@ -136,6 +664,11 @@ class Record:
         self.phones = [phone] if phone else []
         self.birthday = birthday
 
+    def copy(self):
+        record = Record(self.name, birthday=self.birthday)
+        record.phones = self.phones.copy()
+        return record
+
     def add_birthday(self, date: Birthday) -> None:
         self.birthday = date
 
@@ -146,17 +679,13 @@ class Record:
         if phones[0].value != "":
             self.phones.extend(phones)
 
-    def days_to_birthday(self):
+    def days_to_birthday(self, difference: int = None):
         if not self.birthday:
             return f"{self.name.value}'s birthday is unknown"
-        date_bd = datetime.strptime(self.birthday.value, self.birthday.format)
-        current_day = datetime.now()
-        date_bd = datetime(year=current_day.year, month=date_bd.month, day=date_bd.day)
-        difference = (date_bd - current_day).days
+        if difference is None:
+            difference = self.birthday.days_from(date.today())
         if difference == 0:
             return f"{self.name.value}'s birthday is today!"
-        elif difference < 0:
-            difference = difference + 365 + calendar.isleap(current_day.year)
         return f"{self.birthday.value} It's {difference} days to {self.name.value}'s birthday."
 
     def delete_phone(self, pos: int = 0) -> None:
@@ -206,15 +735,19 @@ class UserInterfaceAddressBook(UI):
         self.contacts = contacts
 
     def decorator_input(func: Callable) -> Callable:
+        measured = metrics.instrument(func)
+
         @functools.wraps(func)
         def wrapper(*words):
             try:
-                return func(*words)
+                return measured(*words)
             except KeyError as err:
                 return err
             except IndexError:
                 return "You didn't enter the phone/birthday or a user"
-            except TypeError:
+            except TypeError as err:
+                if raised_inside(err, func):
+                    return err
                 return "Sorry, this command doesn't exist"
             except Exception as err:
                 return err
@@ -223,20 +756,24 @@ class UserInterfaceAddressBook(UI):
 
     @decorator_input
     def add_birthday(self, *args: str) -> str:
-        record = self.contacts.get(args[0])
+        record = self.contacts[args[0]]
+        previous = record.copy()
         record.add_birthday(Birthday(args[1]))
+        self.contacts.update_record(record, previous, f"add_birthday {args[0]}")
         return "Done!"
 
     @decorator_input
     def add_phone(self, *args: str) -> str:
-        record = self.contacts.get(args[0])
+        record = self.contacts[args[0]]
+        previous = record.copy()
         record.add_phone(Phone(args[1]))
+        self.contacts.update_record(record, previous, f"add_phone {args[0]}")
         return "Done!"
 
     @decorator_input
     def add_user(self, *args: str) -> str:
         name = Name(args[0])
-        if name.value in self.contacts.keys():
+        if name.value in self.contacts:
             return "This user already exists."
         else:
             record = Record(name)
@@ -256,28 +793,66 @@ class UserInterfaceAddressBook(UI):
             except ValueError as err:
                 mes = f"{mes} {err}"
             self.contacts.add_record(record)
+            self.contacts.history.record(
+                f"add {name.value}",
+                ("delete_record", (name.value,)),
+                ("restore_record", (record.copy(),)),
+            )
+            duplicates = self.contacts.duplicates_of(record)
+            if duplicates:
+                mes = f"{mes} Possible duplicates: {', '.join(duplicates)}. Use 'merge {name.value} <User name>' to merge them."
             return mes
 
     @decorator_input
     def birthday(self, *args: str) -> str:
-        record = self.contacts.get(args[0])
-        return record.days_to_birthday()
+        record = self.contacts[args[0]]
+        return record.days_to_birthday(self.contacts.birthday_distance(record.name.value))
+
+    @decorator_input
+    def birthdays(self, *args: str) -> str:
+        report = self.contacts.birthdays_report()
+        if args:
+            report = [(days, name) for days, name in report if days <= int(args[0])]
+        if not report:
+            return "No birthdays found"
+        return "\n".join([f"{name}: in {days} days" if days else f"{name}: today!" for days, name in report])
 
     @decorator_input
     def change(self, *args: str) -> str:
-        record = self.contacts.get(args[0])
+        record = self.contacts[args[0]]
+        previous = record.copy()
         mes = record.edit_phone(Phone(args[1]))
+        if mes == "Done!":
+            self.contacts.update_record(record, previous, f"change {args[0]}")
         return mes
 
     @decorator_input
     def delete_phone(self, *args: str) -> str:
-        record = self.contacts.get(args[0])
+        record = self.contacts[args[0]]
+        previous = record.copy()
         mes = record.delete_phone()
+        if mes == "Done!":
+            self.contacts.update_record(record, previous, f"delete_phone {args[0]}")
         return mes
 
     @decorator_input
     def delete_user(self, *args: str) -> str:
-        return self.contacts.delete_record(args[0])
+        record = self.contacts.find_record(args[0])
+        mes = self.contacts.delete_record(args[0])
+        if record:
+            self.contacts.history.record(
+                f"delete {args[0]}",
+                ("restore_record", (record,)),
+                ("delete_record", (args[0],)),
+            )
+        return mes
+
+    @decorator_input
+    def duplicates(self) -> str:
+        clusters = self.contacts.duplicate_clusters()
+        if not clusters:
+            return "No duplicates found"
+        return "\n".join([", ".join(names) for names in clusters])
 
     @decorator_input
     def hello(self) -> str:
@@ -295,32 +870,74 @@ class UserInterfaceAddressBook(UI):
     def goodbye(self):
         return common.goodbye()
 
+    @decorator_input
+    def merge(self, *args: str) -> str:
+        names = list(dict.fromkeys(args))
+        if len(names) == 1:
+            primary = self.contacts[names[0]]
+            names += self.contacts.duplicates_of(primary)
+        if len(names) < 2:
+            return "There is nothing to merge this user with."
+        records = [self.contacts[name] for name in names]
+        merged, conflicts = merge_records(records)
+        self.contacts.replace_records([merged], names[1:])
+        self.contacts.history.record(
+            f"merge {' '.join(names)}",
+            ("replace_records", (records, [])),
+            ("replace_records", ([merged], names[1:])),
+        )
+        return "\n".join([f"{', '.join(names[1:])} merged into {names[0]}.", *conflicts])
+
     @decorator_input
     def phone(self, *args: str) -> str:
-        record = self.contacts[args[0]]
-        return record.show_phone()
+        def show_phone():
+            record = self.contacts[args[0]]
+            return record.show_phone()
+
+        return query_cache.cached(
+            ("addressbook.phone", args[0]), self.contacts.generation, show_phone
+        )
 
     @decorator_input
     def show(self, *args: str) -> str:
-        found = []
-        arg = re.sub("\+", "\\+", args[0])
-        for record in self.contacts.values():
-            match = re.search(
-                arg,
-                f"{record.name.value}|{'|'.join([phone.value for phone in record.phones])}",
-            )
-            if match:
-                found.append(record)
-        if len(found) == 0:
-            return "No matches"
-        return "\n".join([record.show_record() for record in found])
+        args, limit = split_limit(args)
 
+        def show_found():
+            found = self.contacts.search(args[0], limit)
+            if len(found) == 0:
+                return "No matches"
+            return "\n".join([record.show_record() for record in found])
+
+        return query_cache.cached(
+            ("addressbook.show", args[0], limit),
+            self.contacts.generation,
+            show_found,
+        )
+
+    @decorator_input
     def showall(self):
         return self.contacts.show_records()
 
+    @decorator_input
+    def profile(self, *args: str) -> str:
+        return metrics.arm_profile(self.get_command(list(args), commands_dict))
+
+    @decorator_input
+    def stats(self) -> str:
+        return "\n".join([metrics.report(), query_cache.report()])
+
+    @decorator_input
+    def undo(self) -> str:
+        return self.contacts.undo()
+
+    @decorator_input
+    def redo(self) -> str:
+        return self.contacts.redo()
+
 
 contacts = AddressBook()
 ui = UserInterfaceAddressBook(contacts)
+autosaver = None
 
 commands_dict = {
     ("hello", "hi", "hey"): ui.hello,
@@ -328,13 +945,20 @@ commands_dict = {
     ("add_birthday",): ui.add_birthday,
     ("add_phone",): ui.add_phone,
     ("birthday",): ui.birthday,
+    ("birthdays",): ui.birthdays,
     ("help",): ui.display_help,
     ("show",): ui.show,
     ("change",): ui.change,
     ("delete_phone",): ui.delete_phone,
     ("delete",): ui.delete_user,
+    ("duplicates",): ui.duplicates,
+    ("merge",): ui.merge,
     ("phone",): ui.phone,
     ("showall",): ui.showall,
+    ("undo",): ui.undo,
+    ("stats",): ui.stats,
+    ("profile",): ui.profile,
+    ("redo",): ui.redo,
     ("goodbye", "close", "exit", "quit"): ui.goodbye,
 }
 
@@ -347,15 +971,34 @@ commands_description = [
     ],
     ["add_phone", "Add existing user's phone number", "add_phone <User name> <number>"],
     ["birthday", "Display user's birthday", "birthday <User name>"],
+    [
+        "birthdays",
+        "Display users' birthdays sorted by the days left, optionally within n days",
+        "birthdays <n>",
+    ],
     ["change", "Edit user's phone", "change <User name>"],
     ["Delete", "Delete user", "delete <User name>"],
     ["Delete_phone", "Delete user's phone number", "delete_phone <User name>"],
+    ["duplicates", "Display the groups of users with the same phone or a similar name", "duplicates"],
+    [
+        "merge",
+        "Merge users into the first one (or a user with its duplicates)",
+        "merge <User name> <User name> ...",
+    ],
     ["goodbye/close/exit/quit", "Any of these commands will exit the app", "quit"],
     ["help", "Get help", "help"],
     ["hello/hi/hey", "Greet the Addressbook", "hi"],
     ["phone", "Display user's phone number", "phone <User name>"],
-    ["show", "Display existing user's info", "show <User name>"],
+    [
+        "show",
+        "Display the users whose name or phone match, optionally the first n of them",
+        "show <User name> --limit <n>",
+    ],
     ["showall", "Dislplay all users' info", "showall"],
+    ["undo", "Undo the last change of the Book", "undo"],
+    ["redo", "Redo the last undone change of the Book", "redo"],
+    ["stats", "Display the latency, calls and errors of the commands", "stats"],
+    ["profile", "Profile the next call of a command, see the report with 'stats'", "profile <command>"],
 ]
 
 commands_list = [cmd for cmds in commands_dict.keys() for cmd in cmds]
@@ -363,9 +1006,15 @@ word_completer = WordCompleter(commands_list)
 
 
 def main():
+    global contacts, autosaver
+    if SHARDS > 1 and not isinstance(contacts, ShardedAddressBook):
+        contacts = ui.contacts = ShardedAddressBook(SHARDS)
     colorit.init_colorit()
     print(ui.greeting())
     contacts.get_contacts("contacts.bin")
+    if autosaver is None:
+        autosaver = AutoSaver(lambda: contacts.flush_changes("contacts.bin"))
+        autosaver.start()
     while True:
         words = prompt("Your command >>> ", completer=word_completer).split(" ")
         try:
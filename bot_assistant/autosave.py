@@ -0,0 +1,113 @@
+import atexit
+import os
+import pickle
+import signal
+import sys
+import threading
+from typing import Callable
+
+AUTOSAVE_INTERVAL = 5.0
+JOURNAL_LIMIT = 1024 * 1024
+
+
+class AutoSaver:
+    '''Background thread that flushes the changed records every AUTOSAVE_INTERVAL seconds.
+
+    All the edits made during an interval are saved with one flush, so the prompt is never blocked by saving.
+    The last flush runs on the interpreter exit, including Ctrl-C, SIGTERM and SIGHUP.
+    '''
+
+    def __init__(self, flush: Callable, interval: float = AUTOSAVE_INTERVAL) -> None:
+        self.flush = flush
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        atexit.register(self.stop)
+        exit_on_signals()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.save()
+
+    def save(self) -> None:
+        with self.lock:
+            try:
+                self.flush()
+            except Exception as err:
+                print(f"Autosave failed, it will be retried: {err}")
+
+    def stop(self) -> None:
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.save()
+
+
+def exit_on_signals() -> None:
+    '''Turns SIGTERM and SIGHUP into a normal exit, so the atexit flushes run.'''
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for name in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: sys.exit(128 + signum))
+
+
+def journal_file(file_name: str) -> str:
+    return f"{file_name}.journal"
+
+
+def append_journal(file_name: str, entry: bytes) -> int:
+    '''Appends a pickled (changes, history events) entry to the journal of the file. Returns the size of the journal.'''
+    with open(journal_file(file_name), 'ab') as fh:
+        fh.write(entry)
+        fh.flush()
+        os.fsync(fh.fileno())
+        return fh.tell()
+
+
+def replay_journal(file_name: str, data: dict, history):
+    '''Applies the journal entries to the loaded data: a changed key gets its new value, a removed one (None) is popped.
+
+    The history events of the entries are replayed on the loaded history, which is returned.
+    A journal written before the events were journaled holds whole histories, the last one is returned.
+    A torn last entry (a crash while writing it) is ignored.
+    '''
+    try:
+        fh = open(journal_file(file_name), 'rb')
+    except FileNotFoundError:
+        return history
+    with fh:
+        while True:
+            try:
+                changes, events = pickle.load(fh)
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+            if isinstance(events, list):
+                history.replay(events)
+            else:
+                history = events
+            for key, value in changes.items():
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+    return history
+
+
+def remove_journal(file_name: str) -> None:
+    try:
+        os.remove(journal_file(file_name))
+    except FileNotFoundError:
+        pass
+
+
+def write_atomic(file_name: str, obj) -> None:
+    temp_file = f"{file_name}.tmp"
+    with open(temp_file, 'wb') as fh:
+        pickle.dump(obj, fh)
+    os.replace(temp_file, file_name)
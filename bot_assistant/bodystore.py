@@ -0,0 +1,59 @@
+import hashlib
+import os
+import zlib
+from pathlib import Path
+
+BODY_STORE = 'notes_bodies'
+INLINE_LIMIT = 4096
+
+
+class BodyStore:
+    '''Content-addressed store of zlib-compressed note bodies.
+
+    Every body is saved once under the sha256 of its text, so saving the notes never rewrites it
+    and the same text pasted to several notes is kept once. The bodies nothing refers to any more
+    are removed by sweep.
+    '''
+
+    def __init__(self, folder: str = BODY_STORE) -> None:
+        self.folder = Path(folder)
+        self.session_keys = set()
+
+    def path(self, key: str) -> Path:
+        return self.folder/key[:2]/key
+
+    def put(self, text: str) -> str:
+        data = text.encode('utf-8')
+        key = hashlib.sha256(data).hexdigest()
+        self.session_keys.add(key)
+        path = self.path(key)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix('.tmp')
+            temp_path.write_bytes(zlib.compress(data))
+            os.replace(temp_path, path)
+        return key
+
+    def get(self, key: str) -> str:
+        try:
+            return zlib.decompress(self.path(key).read_bytes()).decode('utf-8')
+        except FileNotFoundError:
+            raise KeyError(f"The body of this note wasn't found in {self.folder}")
+
+    def sweep(self, keys: set) -> int:
+        '''Removes the bodies that aren't in keys. Returns the number of removed bodies.
+
+        The bodies put by this process are kept too: a handler may still be waiting for input
+        before it adds the note that refers to its new body.
+        '''
+        keep = keys | self.session_keys
+        removed = 0
+        for path in self.folder.glob('*/*'):
+            if path.suffix == '.tmp' or path.name in keep:
+                continue
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+from typing import Callable
+
+CACHE_SIZE = 256
+
+
+class QueryCache:
+    '''LRU cache of the query results.
+
+    Every entry remembers the generation of the book it was computed from. The books bump their
+    generation on every change, so an entry computed before a change is never returned.
+    '''
+
+    def __init__(self, maxsize: int = CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key: tuple, generation: int, compute: Callable):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == generation:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = compute()
+        self.entries[key] = (generation, result)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return result
+
+    def report(self) -> str:
+        requests = self.hits + self.misses
+        rate = f"{self.hits / requests:.0%}" if requests else "n/a"
+        return f"Query cache: {self.hits} hits, {self.misses} misses (hit rate {rate}), {len(self.entries)}/{self.maxsize} entries"
+
+
+query_cache = QueryCache()
@@ -0,0 +1,124 @@
+from collections import defaultdict
+
+from fuzzy import fuzzy_key
+
+PHONE_KEY_DIGITS = 9
+
+
+def phone_key(phone: str) -> str:
+    '''Last digits of the number, so "+380 (50) 123-45-67" and "0501234567" get the same key.'''
+    digits = ''.join(d for d in phone if d.isdigit())
+    return digits[-PHONE_KEY_DIGITS:]
+
+
+def name_key(name: str) -> str:
+    '''Blocking key of a name: transliterated lowercase words in alphabetical order, without other characters.
+
+    "Petrenko Ivan", "ivan_petrenko" and "Іван Петренко" get the same key.
+    '''
+    words = ''.join(c if c.isalpha() else ' ' for c in fuzzy_key(name)).split()
+    return ' '.join(sorted(words))
+
+
+def record_keys(record) -> tuple[set, str]:
+    return {phone_key(phone.value) for phone in record.phones}, name_key(record.name.value)
+
+
+def find_clusters(entries) -> list[list[str]]:
+    '''Groups the names sharing a phone key or a name key with union-find in O(N).
+
+    entries is an iterable of (name, phone keys, name key). Returns the groups of two or more names.
+    '''
+    parent = {}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    owners = {}
+    for name, phone_keys, block in entries:
+        parent.setdefault(name, name)
+        keys = [('phone', key) for key in phone_keys]
+        if block:
+            keys.append(('name', block))
+        for key in keys:
+            if key in owners:
+                parent[find(name)] = find(owners[key])
+            else:
+                owners[key] = name
+    clusters = defaultdict(list)
+    for name in parent:
+        clusters[find(name)].append(name)
+    return [sorted(names) for names in clusters.values() if len(names) > 1]
+
+
+def merge_records(records: list) -> tuple:
+    '''Merges the records into a copy of the first one.
+
+    The phones are united (the same number in another format is added once).
+    The first known birthday is kept, other different birthdays are reported as conflicts.
+    Returns (merged record, list of conflict messages).
+    '''
+    merged = records[0].copy()
+    seen = {phone_key(phone.value) for phone in merged.phones}
+    conflicts = []
+    for record in records[1:]:
+        for phone in record.phones:
+            if phone_key(phone.value) not in seen:
+                seen.add(phone_key(phone.value))
+                merged.add_phone(phone)
+        if record.birthday is None:
+            continue
+        if merged.birthday is None:
+            merged.add_birthday(record.birthday)
+        elif record.birthday.value != merged.birthday.value:
+            conflicts.append(
+                f"{record.name.value}'s birthday {record.birthday.value} was dropped, {merged.birthday.value} was kept."
+            )
+    return merged, conflicts
+
+
+class DuplicateIndex:
+    '''Phone key and name key postings of the records, updated on every insert and removal.'''
+
+    def __init__(self) -> None:
+        self.phones = defaultdict(set)
+        self.names = defaultdict(set)
+        self.keys = {}
+
+    def add(self, record) -> None:
+        name = record.name.value
+        self.remove(name)
+        phone_keys, block = record_keys(record)
+        self.keys[name] = (phone_keys, block)
+        for key in phone_keys:
+            self.phones[key].add(name)
+        if block:
+            self.names[block].add(name)
+
+    def remove(self, name: str) -> None:
+        if name not in self.keys:
+            return
+        phone_keys, block = self.keys.pop(name)
+        for key in phone_keys:
+            self.phones[key].discard(name)
+            if not self.phones[key]:
+                del self.phones[key]
+        if block:
+            self.names[block].discard(name)
+            if not self.names[block]:
+                del self.names[block]
+
+    def candidates(self, record) -> set:
+        '''Names of the other records sharing a phone or a name key with the record.'''
+        phone_keys, block = record_keys(record)
+        found = set(self.names.get(block, ()))
+        for key in phone_keys:
+            found.update(self.phones.get(key, ()))
+        found.discard(record.name.value)
+        return found
+
+    def entries(self) -> list:
+        return [(name, phone_keys, block) for name, (phone_keys, block) in self.keys.items()]
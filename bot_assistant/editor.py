@@ -0,0 +1,63 @@
+import hashlib
+import os
+import shlex
+import subprocess
+import tempfile
+
+TAGS_HEADER = 'Tags: '
+BODY_SEPARATOR = "----- Separate tags with ','. Write the note below this line -----"
+
+
+def get_editor() -> list[str]:
+    '''Returns the command of the user's editor: $VISUAL, $EDITOR or the system default.'''
+    editor = os.environ.get('VISUAL') or os.environ.get('EDITOR')
+    if editor:
+        return shlex.split(editor, posix=os.name != 'nt')
+    if os.name == 'nt':
+        return ['notepad']
+    return ['vi']
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.rstrip('\n').encode('utf-8')).hexdigest()
+
+
+def edit_text(text: str) -> str | None:
+    '''Opens the text in the editor and waits until it's closed.
+
+    Every edit gets its own temporary file, so several edits never share a file.
+    Returns None if the text wasn't changed.
+    '''
+    fd, path = tempfile.mkstemp(prefix='note_', suffix='.txt', text=True)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write(text)
+        command = get_editor()
+        try:
+            subprocess.run([*command, path], check=True)
+        except FileNotFoundError:
+            raise RuntimeError(f"The editor '{command[0]}' wasn't found. Set the EDITOR variable to your text editor.")
+        except subprocess.CalledProcessError as err:
+            raise RuntimeError(f"The editor exited with the code {err.returncode}, the note wasn't changed.")
+        with open(path, 'r', encoding='utf-8') as fh:
+            edited_text = fh.read()
+    finally:
+        os.remove(path)
+    if text_hash(edited_text) == text_hash(text):
+        return None
+    return edited_text
+
+
+def edit_note(body: str, tags: str) -> tuple[str, str] | None:
+    '''Edits the body and the tags of a note in one file with the tags in a header.
+
+    Returns (body, tags) or None if nothing was changed.
+    '''
+    edited_text = edit_text(f'{TAGS_HEADER}{tags}\n{BODY_SEPARATOR}\n{body}')
+    if edited_text is None:
+        return None
+    header, separator, edited_body = edited_text.partition(f'\n{BODY_SEPARATOR}\n')
+    if not separator:
+        raise ValueError("The note wasn't changed because the separator line was removed.")
+    edited_tags = header.removeprefix(TAGS_HEADER).strip()
+    return edited_body.rstrip('\n'), edited_tags
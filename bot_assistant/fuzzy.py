@@ -0,0 +1,59 @@
+import heapq
+from collections import Counter, defaultdict
+
+from rename import normalize
+
+SUGGESTIONS_NUMBER = 3
+MIN_SIMILARITY = 0.3
+
+
+def fuzzy_key(name: str) -> str:
+    '''Transliterates and lowercases the name, so "Іван" and "ivan" get the same key.'''
+    return normalize(name).lower()
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    '''Incremental trigram index over the names.
+
+    Suggestions are looked up only among the names sharing a trigram with the query
+    and ranked by the Dice coefficient of the trigram sets, so the whole book isn't scanned.
+    '''
+
+    def __init__(self) -> None:
+        self.postings = defaultdict(set)
+        self.names = {}
+
+    def add(self, name: str) -> None:
+        if name in self.names:
+            return
+        grams = trigrams(fuzzy_key(name))
+        self.names[name] = len(grams)
+        for gram in grams:
+            self.postings[gram].add(name)
+
+    def remove(self, name: str) -> None:
+        if self.names.pop(name, None) is None:
+            return
+        for gram in trigrams(fuzzy_key(name)):
+            self.postings[gram].discard(name)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def rank(self, query: str, limit: int = SUGGESTIONS_NUMBER) -> list[tuple[float, str]]:
+        grams = trigrams(fuzzy_key(query))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = (
+            (2 * count / (len(grams) + self.names[name]), name)
+            for name, count in shared.items()
+        )
+        return [(score, name) for score, name in heapq.nlargest(limit, scored) if score >= MIN_SIMILARITY]
+
+    def suggest(self, query: str, limit: int = SUGGESTIONS_NUMBER) -> list[str]:
+        return [name for score, name in self.rank(query, limit)]
@@ -0,0 +1,109 @@
+import os
+from collections import deque
+
+HISTORY_LIMIT = int(os.environ.get('ASSISTANT_HISTORY_LIMIT', '50'))
+
+
+class Operation:
+    '''One change of a book: the method name and arguments that revert it and the ones that repeat it.
+
+    The arguments are snapshots of a single record/note, so an operation never holds a copy of the whole book.
+    '''
+
+    def __init__(self, description: str, undo: tuple, redo: tuple) -> None:
+        self.description = description
+        self.undo = undo
+        self.redo = redo
+
+
+class History:
+    '''Bounded undo/redo log of the operations. It is pickled together with the book it belongs to.
+
+    Every change of the history is also logged as an event numbered by the version, so the journal
+    only gets the events since the last flush instead of the whole history.
+    '''
+
+    version: int = 0
+
+    def __init__(self, limit: int = HISTORY_LIMIT) -> None:
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = deque(maxlen=limit)
+        self.events = deque()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('events', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.events = deque()
+
+    def log(self, *event) -> None:
+        self.version += 1
+        self.events.append((self.version, event))
+
+    def take_events(self) -> list:
+        '''Removes and returns the events logged since the last call, for the journal.'''
+        return [self.events.popleft() for _ in range(len(self.events))]
+
+    def forget_events(self, version: int) -> None:
+        '''Drops the events that a history saved at this version already contains.'''
+        while self.events and self.events[0][0] <= version:
+            self.events.popleft()
+
+    def replay(self, events: list) -> None:
+        '''Applies the journaled events to a loaded history, skipping the ones it already contains.'''
+        for version, (kind, *args) in events:
+            if version <= self.version:
+                continue
+            if kind == 'record':
+                self.undo_stack.append(args[0])
+                self.redo_stack.clear()
+            elif kind == 'undo' and self.undo_stack:
+                self.redo_stack.append(self.undo_stack.pop())
+            elif kind == 'redo' and self.redo_stack:
+                self.undo_stack.append(self.redo_stack.pop())
+            self.version = version
+
+    def record(self, description: str, undo: tuple, redo: tuple) -> None:
+        operation = Operation(description, undo, redo)
+        self.undo_stack.append(operation)
+        self.redo_stack.clear()
+        self.log('record', operation)
+
+    def arguments(self):
+        '''Yields the arguments of all the kept operations, the snapshots of the records/notes among them.'''
+        for operation in (*self.undo_stack, *self.redo_stack):
+            for _, args in (operation.undo, operation.redo):
+                yield from args
+
+    def resize(self, limit: int = HISTORY_LIMIT) -> None:
+        '''Applies the current limit to a history loaded from a file, which keeps the limit it was saved with.'''
+        if self.undo_stack.maxlen == limit:
+            return
+        self.undo_stack = deque(self.undo_stack, maxlen=limit)
+        self.redo_stack = deque(self.redo_stack, maxlen=limit)
+
+    def undo(self, book) -> str:
+        if not self.undo_stack:
+            return "There is nothing to undo."
+        operation = self.undo_stack.pop()
+        apply(book, operation.undo)
+        self.redo_stack.append(operation)
+        self.log('undo')
+        return f"Undone: {operation.description}"
+
+    def redo(self, book) -> str:
+        if not self.redo_stack:
+            return "There is nothing to redo."
+        operation = self.redo_stack.pop()
+        apply(book, operation.redo)
+        self.undo_stack.append(operation)
+        self.log('redo')
+        return f"Redone: {operation.description}"
+
+
+def apply(book, action: tuple) -> None:
+    method_name, args = action
+    getattr(book, method_name)(*args)
@@ -0,0 +1,392 @@
+'''Load and soak test of the command loops.
+
+Drives the real commands_dict handlers of the Addressbook and the Notepad (and the Sort pipeline)
+with a random or recorded command mix, in a temporary folder, and reports per-command
+p50/p95/p99 latency as JSON, so runs of different versions can be compared. Memory growth is
+traced with --trace-memory in a separate run, tracemalloc slows down every allocation.
+
+    python loadtest.py addressbook --size 10000 --ops 5000 --rate 200 --output new.json --compare old.json
+    python loadtest.py notepad --script commands.txt --duration 600 --trace-memory
+    python loadtest.py sort --size 20000 --ops 20
+'''
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shlex
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from prettytable import PrettyTable
+
+import addressbook
+import common
+import notepad
+import sort
+
+MEMORY_SAMPLES = 20
+EDITOR_VARIABLES = ('VISUAL', 'EDITOR')
+LARGE_NOTES_SHARE = 0.1
+EDITOR_SCRIPT = '''import sys
+with open(sys.argv[1], 'a', encoding='utf-8') as fh:
+    fh.write('\\n' + 'edited by the load test ' * 100)
+'''
+WORDS = ['alpha', 'beta', 'log', 'error', 'meeting', 'todo', 'idea', 'python', 'report', 'travel']
+EXTENTIONS = [ext for extentions in sort.SORTING_DICT.values() for ext in extentions if ext not in ('.zip', '.gz', '.tar')] + ['.xyz', '.bin']
+
+ADDRESSBOOK_MIX = {
+    'add': 10, 'add_phone': 8, 'add_birthday': 4, 'phone': 20, 'show': 15, 'showall': 5, 'birthday': 8,
+    'birthdays': 2, 'change': 5, 'delete_phone': 3, 'delete': 3, 'duplicates': 1, 'undo': 2, 'redo': 1,
+}
+NOTEPAD_MIX = {
+    'add': 10, 'show': 25, 'showall': 5, 'find': 20, 'find_tags': 20, 'edit': 5, 'delete': 3, 'undo': 2, 'redo': 1,
+}
+
+
+def random_name(rng: random.Random) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))).capitalize()
+
+
+def random_phone(rng: random.Random) -> str:
+    return f"+380{rng.randint(100000000, 999999999)}"
+
+
+def random_birthday(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}"
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+class ScriptedInput:
+    '''Answers the input() prompts of the handlers, so the interactive commands can run unattended.'''
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+        self.titles = 0
+
+    def __call__(self, message: str = '') -> str:
+        if message.startswith('Enter the title'):
+            self.titles += 1
+            return f"Note{self.titles}{random_name(self.rng)}"
+        if message.startswith('Enter the note'):
+            return random_text(self.rng, self.rng.randint(5, 200))
+        if message.startswith('Enter tags'):
+            return ', '.join(self.rng.sample(WORDS, 2))
+        if message.startswith('Enter the index'):
+            return '0'
+        if message.startswith('Enter any letter'):
+            return 'y'
+        return ''
+
+
+class CommandLoad:
+    '''Dataset and command generator of an interactive app.'''
+
+    def __init__(self, module, mix: dict, rng: random.Random) -> None:
+        self.module = module
+        self.mix = mix
+        self.rng = rng
+        self.names = []
+
+    def pick(self, existing: bool = True) -> str:
+        if self.names and (existing or self.rng.random() < 0.8):
+            return self.rng.choice(self.names)
+        return random_name(self.rng)
+
+    def commands(self, script: list[str] = None):
+        if script:
+            while True:
+                yield from script
+        commands, weights = zip(*self.mix.items())
+        while True:
+            yield self.make_command(self.rng.choices(commands, weights)[0])
+
+    def run(self, line: str) -> str:
+        words = line.split(' ')
+        func = common.get_command(words, self.module.commands_dict)
+        return func(*words[1:])
+
+
+class AddressBookLoad(CommandLoad):
+    def __init__(self, rng: random.Random, shards: int) -> None:
+        super().__init__(addressbook, ADDRESSBOOK_MIX, rng)
+        if shards > 1:
+            addressbook.contacts = addressbook.ui.contacts = addressbook.ShardedAddressBook(shards)
+
+    def populate(self, size: int) -> None:
+        contacts = addressbook.ui.contacts
+        for _ in range(size):
+            name = f"{random_name(self.rng)}{len(self.names)}"
+            record = addressbook.Record(addressbook.Name(name), addressbook.Phone(random_phone(self.rng)))
+            if self.rng.random() < 0.5:
+                record.add_birthday(addressbook.Birthday(random_birthday(self.rng)))
+            contacts.add_record(record)
+            self.names.append(name)
+
+    def make_command(self, command: str) -> str:
+        if command == 'add':
+            name = f"{random_name(self.rng)}{len(self.names)}"
+            self.names.append(name)
+            return f"add {name} {random_phone(self.rng)} {random_birthday(self.rng)}"
+        if command in ('add_phone', 'change'):
+            return f"{command} {self.pick()} {random_phone(self.rng)}"
+        if command == 'add_birthday':
+            return f"add_birthday {self.pick()} {random_birthday(self.rng)}"
+        if command in ('phone', 'birthday', 'delete_phone'):
+            return f"{command} {self.pick(existing=False)}"
+        if command == 'show':
+            return f"show {self.pick()[:3]}"
+        if command == 'birthdays':
+            return f"birthdays {self.rng.randint(1, 60)}"
+        if command == 'delete':
+            return f"delete {self.pick()}"
+        return command
+
+
+class NotePadLoad(CommandLoad):
+    '''Edits go through the real editor path with an "editor" that appends some text to the note,
+    so every edit changes the body and the larger bodies move to the body store.
+    '''
+
+    def __init__(self, rng: random.Random) -> None:
+        super().__init__(notepad, NOTEPAD_MIX, rng)
+        script = Path('editor.py').resolve()
+        script.write_text(EDITOR_SCRIPT, encoding='utf-8')
+        for name in EDITOR_VARIABLES:
+            os.environ[name] = shlex.join([sys.executable, str(script)])
+
+    def populate(self, size: int) -> None:
+        for number in range(size):
+            title = f"Note{number}{random_name(self.rng)}"
+            words = 1000 if self.rng.random() < LARGE_NOTES_SHARE else self.rng.randint(5, 200)
+            body = notepad.make_body(random_text(self.rng, words))
+            tags = [notepad.NoteTag(tag) for tag in self.rng.sample(WORDS, 2)]
+            notepad.notes.add_note(notepad.Note(notepad.NoteTitle(title), body, tags))
+            self.names.append(title)
+
+    def make_command(self, command: str) -> str:
+        if command in ('show', 'edit', 'delete'):
+            return f"{command} {self.pick(existing=False)}"
+        if command == 'find':
+            return f"find {self.rng.choice(WORDS)} {self.rng.choice(WORDS)}"
+        if command == 'find_tags':
+            return f"find_tags {' '.join(self.rng.sample(WORDS, 2))}"
+        return command
+
+
+class SortLoad:
+    '''Sorts a generated tree once, then adds a few files before every incremental re-sort.'''
+
+    def __init__(self, rng: random.Random, directory: Path) -> None:
+        self.rng = rng
+        self.directory = directory/'to_sort'
+        self.files = 0
+
+    def add_files(self, number: int) -> None:
+        for _ in range(number):
+            folder = self.directory.joinpath(*[f"dir{self.rng.randint(0, 9)}" for _ in range(self.rng.randint(0, 3))])
+            folder.mkdir(parents=True, exist_ok=True)
+            self.files += 1
+            (folder/f"file {self.files}{self.rng.choice(EXTENTIONS)}").write_bytes(b'x' * self.rng.randint(0, 4096))
+
+    def populate(self, size: int) -> None:
+        self.add_files(size)
+
+    def commands(self, script: list[str] = None):
+        yield 'sort_full'
+        while True:
+            yield 'sort_incremental'
+
+    def run(self, line: str) -> str:
+        if line == 'sort_incremental':
+            self.add_files(self.rng.randint(1, 20))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sort.sort_directory(self.directory, sort.SORTING_DICT)
+
+
+def percentile(latencies: list[float], share: float) -> float:
+    index = min(len(latencies) - 1, int(round(share * (len(latencies) - 1))))
+    return latencies[index]
+
+
+def summarize(latencies: dict, errors: dict) -> dict:
+    result = {}
+    for command, values in sorted(latencies.items()):
+        values.sort()
+        result[command] = {
+            'count': len(values),
+            'errors': errors.get(command, 0),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        }
+    return result
+
+
+def get_version() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_load(load, args) -> dict:
+    script = None
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as fh:
+            script = [line.strip() for line in fh if line.strip()]
+    latencies = {}
+    errors = {}
+    memory = []
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    load.populate(args.size)
+    populated = time.perf_counter()
+    memory_step = max(1, args.ops // MEMORY_SAMPLES) if args.ops else 100
+    operations = 0
+    for line in load.commands(script):
+        if args.ops and operations >= args.ops:
+            break
+        if args.duration and time.perf_counter() - populated >= args.duration:
+            break
+        if args.rate:
+            delay = populated + operations / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        command = line.split(' ')[0]
+        start = time.perf_counter()
+        try:
+            result = load.run(line)
+        except Exception:
+            result = None
+            errors[command] = errors.get(command, 0) + 1
+        latencies.setdefault(command, []).append(time.perf_counter() - start)
+        if isinstance(result, Exception):
+            errors[command] = errors.get(command, 0) + 1
+        operations += 1
+        if args.trace_memory and operations % memory_step == 0:
+            memory.append(tracemalloc.get_traced_memory()[0])
+    finished = time.perf_counter()
+    report = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'app': args.app,
+        'parameters': {
+            'size': args.size, 'ops': args.ops, 'duration': args.duration, 'rate': args.rate,
+            'seed': args.seed, 'script': args.script, 'shards': args.shards, 'trace_memory': args.trace_memory,
+        },
+        'populate_seconds': round(populated - started, 3),
+        'run_seconds': round(finished - populated, 3),
+        'operations': operations,
+        'ops_per_second': round(operations / (finished - populated), 1) if finished > populated else 0,
+        'commands': summarize(latencies, errors),
+    }
+    if args.trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        first = memory[0] if memory else current
+        report['memory'] = {
+            'first_sample_kib': round(first / 1024, 1),
+            'final_kib': round(current / 1024, 1),
+            'peak_kib': round(peak / 1024, 1),
+            'growth_kib': round((current - first) / 1024, 1),
+            'samples_kib': [round(sample / 1024, 1) for sample in memory],
+        }
+    return report
+
+
+def compare(report: dict, previous: dict) -> str:
+    table = PrettyTable(['Command', 'p50, ms', 'p95, ms', 'p99, ms'])
+    for command, stats in report['commands'].items():
+        old = previous.get('commands', {}).get(command)
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if old and old[key]:
+                cells.append(f"{old[key]} -> {stats[key]} ({(stats[key] - old[key]) / old[key]:+.0%})")
+            else:
+                cells.append(f"{stats[key]}")
+        table.add_row([command, *cells])
+    table.align = 'l'
+    result = f"{previous.get('version', '?')} -> {report['version']}\n{table}"
+    previous_tracing = previous.get('parameters', {}).get('trace_memory', 'memory' in previous)
+    if previous_tracing != report['parameters']['trace_memory']:
+        result += "\nOnly one of the runs traced the memory, its latencies are higher because of tracemalloc."
+    return result
+
+
+def parse_args(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Load and soak test of the Assistant command loops.')
+    parser.add_argument('app', choices=['addressbook', 'notepad', 'sort'])
+    parser.add_argument('--size', type=int, default=1000, help='records, notes or files created before the run')
+    parser.add_argument('--ops', type=int, default=1000, help='number of commands to run, 0 for no limit')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (soak test)')
+    parser.add_argument('--rate', type=float, default=0, help='commands per second, 0 for as fast as possible')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--script', help='file with recorded commands, one per line, replayed in a loop')
+    parser.add_argument('--shards', type=int, default=1, help='run the Addressbook as a ShardedAddressBook')
+    parser.add_argument('--trace-memory', action='store_true', help='trace the memory with tracemalloc, the latencies are slower then')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare with')
+    args = parser.parse_args(argv)
+    if not args.ops and not args.duration:
+        parser.error('set --ops or --duration')
+    return args
+
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    previous_dir = os.getcwd()
+    previous_input = builtins.input
+    previous_editors = {name: os.environ.get(name) for name in EDITOR_VARIABLES}
+    with tempfile.TemporaryDirectory(prefix='assist_load_') as temp_dir:
+        os.chdir(temp_dir)
+        builtins.input = ScriptedInput(rng)
+        try:
+            if args.app == 'addressbook':
+                load = AddressBookLoad(rng, args.shards)
+            elif args.app == 'notepad':
+                load = NotePadLoad(rng)
+            else:
+                load = SortLoad(rng, Path(temp_dir))
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = run_load(load, args)
+            if args.app == 'addressbook' and args.shards > 1:
+                addressbook.contacts.close()
+        finally:
+            os.chdir(previous_dir)
+            builtins.input = previous_input
+            for name, value in previous_editors.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            fh.write(output)
+    print(output)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as fh:
+            print(compare(report, json.load(fh)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import cProfile
+import functools
+import io
+import pstats
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Callable
+
+from prettytable import PrettyTable
+
+BUCKETS = (0.001, 0.01, 0.1, 1.0)
+BUCKET_NAMES = ('<1ms', '<10ms', '<100ms', '<1s', '>=1s')
+PROFILE_LINES = 15
+
+
+class CommandStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.errors = Counter()
+
+    def add(self, elapsed: float, error: Exception = None) -> None:
+        self.calls += 1
+        self.total += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        self.histogram[bisect_left(BUCKETS, elapsed)] += 1
+        if error is not None:
+            self.errors[type(error).__name__] += 1
+
+
+class Metrics:
+    '''Latency histograms, call counts and error types of the command handlers.
+
+    Listeners added with add_listener are called after every command with
+    (command name, elapsed seconds, exception or None).
+    '''
+
+    def __init__(self) -> None:
+        self.commands = defaultdict(CommandStats)
+        self.listeners = []
+        self.profile_next = set()
+        self.instrumented = set()
+        self.last_profile = ''
+
+    def add_listener(self, listener: Callable) -> None:
+        self.listeners.append(listener)
+
+    def arm_profile(self, func: Callable) -> str:
+        name = command_name(func)
+        if name not in self.instrumented:
+            return f"{name} isn't measured, so it can't be profiled."
+        self.profile_next.add(name)
+        return f"The next call of {name} will be profiled, enter 'stats' after it to see the report."
+
+    def instrument(self, func: Callable) -> Callable:
+        name = command_name(func)
+        self.instrumented.add(name)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            if name in self.profile_next:
+                self.profile_next.discard(name)
+                return self.profile(name, func, *args)
+            error = None
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            except Exception as err:
+                error = err
+                raise
+            finally:
+                self.record(name, time.perf_counter() - start, error)
+
+        return wrapper
+
+    def profile(self, name: str, func: Callable, *args):
+        '''Runs the command under cProfile and tracemalloc and keeps the report for the stats command.'''
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        error = None
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            return func(*args)
+        except Exception as err:
+            error = err
+            raise
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            self.last_profile = f"Profile of {name}: {elapsed * 1000:.2f} ms, peak memory {peak / 1024:.1f} KiB\n{stream.getvalue()}"
+            self.record(name, elapsed, error)
+
+    def record(self, name: str, elapsed: float, error: Exception = None) -> None:
+        self.commands[name].add(elapsed, error)
+        for listener in self.listeners:
+            listener(name, elapsed, error)
+
+    def report(self) -> str:
+        if not self.commands:
+            return "No commands have been run yet."
+        table = PrettyTable(["Command", "Calls", "Mean, ms", "Max, ms", *BUCKET_NAMES, "Errors"])
+        for name, stats in sorted(self.commands.items()):
+            errors = ', '.join(f"{error}: {count}" for error, count in stats.errors.items())
+            table.add_row([name, stats.calls, f"{stats.total / stats.calls * 1000:.2f}", f"{stats.slowest * 1000:.2f}", *stats.histogram, errors])
+        table.align = 'l'
+        return '\n'.join(filter(None, [str(table), self.last_profile]))
+
+
+def command_name(func: Callable) -> str:
+    return f"{func.__module__}.{func.__name__}"
+
+
+def raised_inside(err: Exception, func: Callable) -> bool:
+    '''Tells a TypeError raised by the code of the command from a call with wrong arguments.'''
+    tb = err.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code is func.__code__:
+            return True
+        tb = tb.tb_next
+    return False
+
+
+metrics = Metrics()
@@ -1,8 +1,7 @@
 import functools
-import os
 import pickle
 import re
-import subprocess
+import threading
 from collections import UserDict
 from typing import Callable
 
@@ -10,13 +9,34 @@ from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit import prompt
 
 import common
+import editor
 from abstract_ui import UI
+from autosave import JOURNAL_LIMIT, AutoSaver, append_journal, remove_journal, replay_journal, write_atomic
+from bodystore import INLINE_LIMIT, BodyStore
+from cache import query_cache
+from metrics import metrics, raised_inside
+from search import executor, split_limit
+from history import History
 
 
 class MyException(Exception):
     pass
 
 class NotePad(UserDict):
+    generation: int = 0
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.RLock()
+        self.dirty = set()
+        super().__init__(*args, **kwargs)
+        self.history = History()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('lock', None)
+        state.pop('dirty', None)
+        return state
+
     def __getitem__(self, title):
         if not title in self.data.keys():
             raise MyException("This article isn't in the Notepad")
@@ -24,30 +44,87 @@ class NotePad(UserDict):
         return note
     
     def add_note(self, note) -> str:
-        self.data.update({note.title.value:note})
+        with self.lock:
+            self.data.update({note.title.value:note})
+            self.dirty.add(note.title.value)
+            self.generation += 1
         return 'Done!'
 
     def delete_note(self, title):
-        try:
-            self.data.pop(title)
-            return f"{title} was removed"
-        except KeyError:
-            return "This note isn't in the Notepad"
+        with self.lock:
+            try:
+                self.data.pop(title)
+                self.dirty.add(title)
+                self.generation += 1
+                return f"{title} was removed"
+            except KeyError:
+                return "This note isn't in the Notepad"
+
+    def mark_dirty(self, *titles: str) -> None:
+        with self.lock:
+            self.dirty.update(titles)
+            self.generation += 1
          
     def get_notes(self, file_name):
         with open(file_name, 'ab+') as fh:
             fh.seek(0)
             try:
-                self.data = pickle.load(fh)
+                notepad = pickle.load(fh)
             except EOFError:
-                pass 
+                notepad = self.data
+        if isinstance(notepad, NotePad):
+            self.history = notepad.__dict__.get('history', self.history)
+        while isinstance(notepad, UserDict):
+            notepad = notepad.data
+        with self.lock:
+            self.data = notepad
+            self.history = replay_journal(file_name, self.data, self.history)
+            self.history.resize()
+            self.dirty = set()
+            self.generation += 1
+
+    def replace_note(self, title: str, note) -> None:
+        with self.lock:
+            self.data.pop(title, None)
+            self.data.update({note.title.value:note.copy()})
+            self.dirty.update([title, note.title.value])
+            self.generation += 1
+
+    def undo(self) -> str:
+        return self.history.undo(self)
+
+    def redo(self) -> str:
+        return self.history.redo(self)
 
     def show_notes_titles(self):
         return "\n".join([note for note in notes])
     
+    def stored_body_keys(self) -> set:
+        '''Keys of the stored bodies of the notes and of the note snapshots kept by the history.'''
+        snapshots = [arg for arg in self.history.arguments() if isinstance(arg, Note)]
+        return {note.body.key for note in [*self.data.values(), *snapshots] if isinstance(note.body, StoredNoteBody)}
+
     def write_notes(self, file_name):
-        with open(file_name, "wb") as fh:
-            pickle.dump(self, fh)
+        with self.lock:
+            version = self.history.version
+            write_atomic(file_name, self)
+            remove_journal(file_name)
+            self.dirty = set()
+            self.history.forget_events(version)
+            body_store.sweep(self.stored_body_keys())
+
+    def flush_changes(self, file_name):
+        '''Appends only the changed notes and the new history events to the journal of the file,
+        the whole file is rewritten when the journal grows too big.'''
+        with self.lock:
+            if not self.dirty and not self.history.events:
+                return
+            titles = set(self.dirty)
+            entry = pickle.dumps(({title: self.data.get(title) for title in titles}, self.history.take_events()))
+            journal_size = append_journal(file_name, entry)
+            self.dirty -= titles
+            if journal_size > JOURNAL_LIMIT:
+                self.write_notes(file_name)
 
 
 class Field:
@@ -76,12 +153,33 @@ class NoteBody(Field):
     pass
 
 
+class StoredNoteBody(NoteBody):
+    '''Body of a large note. Only the key is pickled, the text is loaded from the body store on every access.'''
+
+    def __init__(self, key: str, size: int) -> None:
+        self.key = key
+        self.size = size
+
+    @property
+    def value(self):
+        return body_store.get(self.key)
+
+
+def make_body(text: str) -> NoteBody:
+    if len(text) > INLINE_LIMIT:
+        return StoredNoteBody(body_store.put(text), len(text))
+    return NoteBody(text)
+
+
 class Note:
     def __init__(self, title: NoteTitle, body: NoteBody, tags: list[NoteTag]=None) -> None:
         self.title = title
         self.body = body if body else ''
         self.tags = tags if tags else ''
 
+    def copy(self):
+        return Note(self.title, self.body, self.tags[:])
+
     def edit_tags(self, tags: list[NoteTag]):
         self.tags = tags
 
@@ -104,15 +202,19 @@ class Note:
 
 class UserInterfaceNotepad(UI):
     def decorator_input(func: Callable) -> Callable:
+        measured = metrics.instrument(func)
+
         @functools.wraps(func)
         def wrapper(*words):
             try:
-                return func(*words)
+                return measured(*words)
             except KeyError as err:
                 return err
             except IndexError:
                 return "You didn't enter the title or keywords"
-            except TypeError:
+            except TypeError as err:
+                if raised_inside(err, func):
+                    return err
                 return "Sorry, this command doesn't exist"
             except Exception as err:
                 return err
@@ -123,55 +225,53 @@ class UserInterfaceNotepad(UI):
         title = NoteTitle(input("Enter the title: "))
         if title.value in notes.data.keys():
             raise MyException('This title already exists')
-        body = NoteBody(input("Enter the note: "))
+        body = make_body(input("Enter the note: "))
         tags = input("Enter tags (separate them with ',') or press Enter to skip this step: ")
         tags = [NoteTag(t.strip()) for t in tags.split(',')]
         note = Note(title, body, tags)
-        return notes.add_note(note)
+        mes = notes.add_note(note)
+        notes.history.record(f'add {title.value}', ('delete_note', (title.value,)), ('replace_note', (title.value, note.copy())))
+        return mes
 
     @decorator_input
-    def delete_note(*args: str) -> str:
-        return notes.delete_note(args[0])
+    def delete_note(self, *args: str) -> str:
+        note = notes.data.get(args[0])
+        mes = notes.delete_note(args[0])
+        if note:
+            notes.history.record(f'delete {args[0]}', ('replace_note', (args[0], note)), ('delete_note', (args[0],)))
+        return mes
     
     def display_help(self):
         return common.display_help(commands_description)
 
-    @decorator_input
-    def edit(self, text: str, part) -> str:
-        user_input = input(f"Enter any letter if you want to edit {part} or press 'enter' to skip this step. ")
-        if user_input:
-            with open('edit_note.txt', 'w') as fh:
-                fh.write(text)
-            self.run_app()
-            mes = ''
-            if part == 'tags':
-                mes = "Separate tags with ',' "
-            input(f'Press Enter or any letter if you have finished editing. Please, make sure you closed the text editor. {mes}')
-            with open('edit_note.txt', 'r') as fh:
-                edited_text = fh.read()
-            return edited_text
-
-    def edit_body(self, note: Note) -> str:
-        body = self.edit(note.body.value, 'body')
-        if body:
-            body = NoteBody(body)
-            note.edit_body(body)
+    def edit_content(self, note: Note) -> None:
+        user_input = input("Enter any letter if you want to edit the body and tags or press 'enter' to skip this step. ")
+        if not user_input:
+            return
+        edited = editor.edit_note(note.body.value, note.show_tags())
+        if edited is None:
+            return
+        body, tags = edited
+        if body != note.body.value:
+            note.edit_body(make_body(body))
+        if tags != note.show_tags():
+            note.edit_tags([NoteTag(t.strip()) for t in tags.split(',')])
 
     @decorator_input        
     def edit_note(self, *args) -> str:
         title = args[0]
         note = notes.data.get(title)
-        self.edit_title(title, note)
-        self.edit_body(note)
-        self.edit_tags(note)
+        previous = note.copy()
+        try:
+            self.edit_title(title, note)
+            self.edit_content(note)
+        finally:
+            if note.title is not previous.title or note.body is not previous.body or note.tags != previous.tags:
+                new_title = note.title.value
+                notes.mark_dirty(title, new_title)
+                notes.history.record(f'edit {title}', ('replace_note', (new_title, previous)), ('replace_note', (title, note.copy())))
         return "Done!"
 
-    def edit_tags(self, note: Note) -> str:
-        tags = self.edit(note.show_tags(), 'tags')
-        if tags:
-            tags = [NoteTag(t.strip()) for t in tags.split(',')]
-            note.edit_tags(tags)
-    
     def edit_title(self, title: str, note: Note) -> str:
         user_title = input("Enter new title or press 'enter' to skip this step: ")
         if user_title:
@@ -184,12 +284,14 @@ class UserInterfaceNotepad(UI):
     @decorator_input  
     def find(self, *args) -> str:
         #add avoiding special characters \ + etc.
+        args, limit = split_limit(args)
         searched_phrase = ' '.join([arg for arg in args])
-        expression = re.compile(searched_phrase, flags=re.IGNORECASE)
-        found_notes = []
-        for note in notes.data.values():
-            if expression.search(note.body.value) or expression.search(note.title.value):
-                found_notes.append(note.title.value)
+
+        def find_notes():
+            items = [(title, (note.body.value, title)) for title, note in notes.data.items()]
+            return list(executor.search(items, searched_phrase, re.IGNORECASE, limit))
+
+        found_notes = query_cache.cached(('notepad.find', searched_phrase, limit), notes.generation, find_notes)
         found_notes_str = '\n'.join([title for title in found_notes])
         return f"Found {len(found_notes)} article(s) with '{searched_phrase}': \n{found_notes_str}"
         
@@ -197,15 +299,19 @@ class UserInterfaceNotepad(UI):
     def find_tags(self, *args: str) -> str:
         if len(args) == 0:
             return "You didn't enter any tags."
-        all_notes = [note for note in notes.data.values()]
-        notes_dict = {}
-        arg_set = set(args)
-        for note in all_notes:
-            matches = arg_set.intersection(set(tag.value for tag in note.tags))
-            if matches:
-                notes_dict[note.title.value] = ', '.join(matches)
-        sorted_dict = sorted(notes_dict, key=lambda k: len(notes_dict[k]), reverse=True)
-        return '\n'.join([f"{key}: {notes_dict[key]}" for key in sorted_dict])
+        arg_set = frozenset(args)
+
+        def find_notes():
+            all_notes = [note for note in notes.data.values()]
+            notes_dict = {}
+            for note in all_notes:
+                matches = arg_set.intersection(set(tag.value for tag in note.tags))
+                if matches:
+                    notes_dict[note.title.value] = ', '.join(matches)
+            sorted_dict = sorted(notes_dict, key=lambda k: len(notes_dict[k]), reverse=True)
+            return '\n'.join([f"{key}: {notes_dict[key]}" for key in sorted_dict])
+
+        return query_cache.cached(('notepad.find_tags', arg_set), notes.generation, find_notes)
 
     def goodbye(self):
         return common.goodbye()
@@ -213,29 +319,48 @@ class UserInterfaceNotepad(UI):
     def greeting(self):
         return "Welcome to the Notepad assistant! If you need any help navigating the commands, write 'help'"
 
-    @decorator_input  
-    def run_app(self):
-        if os.name == "nt":  # For Windows
-            os.startfile('edit_note.txt')
-        else:  # For Mac
-            subprocess.call(["open", 'edit_note.txt'])
-
     @decorator_input
     def show_note(self, *args:str) -> str:
         note = notes.data.get(args[0])
         return note.show_note()
 
+    @decorator_input
+    def profile(self, *args: str) -> str:
+        return metrics.arm_profile(common.get_command(list(args), commands_dict))
+
+    @decorator_input
+    def showall(self) -> str:
+        return notes.show_notes_titles()
+
+    @decorator_input
+    def stats(self) -> str:
+        return '\n'.join([metrics.report(), query_cache.report()])
+
+    @decorator_input
+    def undo(self) -> str:
+        return notes.undo()
+
+    @decorator_input
+    def redo(self) -> str:
+        return notes.redo()
+
+body_store = BodyStore()
 notes = NotePad()
 ui = UserInterfaceNotepad()
+autosaver = None
 
 commands_dict = {('add', 'add_note'):ui.add_note,
                  ('edit', 'edit_note'):ui.edit_note,
                  ('help',):ui.display_help,
                  ('show', 'show_note'):ui.show_note,
-                 ('showall',):notes.show_notes_titles,
+                 ('showall',):ui.showall,
                  ('find_tags',):ui.find_tags,
                  ('find',):ui.find,
                  ('delete',):ui.delete_note,
+                 ('undo',):ui.undo,
+                 ('stats',):ui.stats,
+                 ('profile',):ui.profile,
+                 ('redo',):ui.redo,
                  ('goodbye','close','exit','quit'):ui.goodbye
 }
 
@@ -244,8 +369,12 @@ commands_description = [['add/add_note', "Any of these commands will add a new n
                         ['show/show_note', "Any of these commands will display a note", 'show/show_note <Note name>'],
                         ['showall', "Dislplay all notes' names", 'showall'],
                         ['find_tags', "Display all the articles with the tag/tags", 'find_tags <tag1> <tag2> ... <tag n>'],
-                        ['find', "Display all the notes containing the search query in their body/title", 'find <text>'],
+                        ['find', "Display all (or the first n) notes containing the search query in their body/title", 'find <text> --limit <n>'],
                         ['delete', "Delete existing note from the Notepad", 'delete <Note name>'],
+                        ['undo', "Undo the last change of the Notepad", 'undo'],
+                        ['redo', "Redo the last undone change of the Notepad", 'redo'],
+                        ['stats', "Display the latency, calls and errors of the commands", 'stats'],
+                        ['profile', "Profile the next call of a command, see the report with 'stats'", 'profile <command>'],
                         ['goodbye/close/exit/quit', "Any of these commands will exit the app", 'goodbye/close/exit/quit']
 ]
 
@@ -253,9 +382,13 @@ commands_list = [cmd for cmds in commands_dict.keys() for cmd in cmds]
 word_completer = WordCompleter(commands_list)
 
 def main():
+    global autosaver
 
     print(ui.greeting())
     notes.get_notes('notes.bin')
+    if autosaver is None:
+        autosaver = AutoSaver(lambda: notes.flush_changes('notes.bin'))
+        autosaver.start()
 
     while True:
         words = prompt("Your command >>>  ", completer = word_completer).split(' ')
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import re
+import time
+
+SEARCH_TIMEOUT = 5.0
+CHUNK_SIZE = 2000
+
+
+def search_chunk(task: tuple) -> list:
+    '''Runs in a pool process: returns the keys of the items whose texts match the pattern.'''
+    pattern, flags, items = task
+    expression = re.compile(pattern, flags)
+    return [key for key, texts in items if any(expression.search(text) for text in texts)]
+
+
+class SearchExecutor:
+    '''Evaluates a regex over chunks of (key, texts) items in a process pool.
+
+    The matches are yielded as the chunks finish. When the deadline passes or the limit is reached
+    the pool is terminated, so a catastrophic-backtracking pattern can't hang the app
+    and no work is left running in the background.
+    '''
+
+    def __init__(self, timeout: float = SEARCH_TIMEOUT, chunk_size: int = CHUNK_SIZE) -> None:
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.pool_owner = None
+
+    def get_pool(self):
+        if self.pool is None or self.pool_owner != os.getpid():
+            self.pool = multiprocessing.Pool()
+            self.pool_owner = os.getpid()
+        return self.pool
+
+    def reset(self) -> None:
+        if self.pool is not None and self.pool_owner == os.getpid():
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def search(self, items: list, pattern: str, flags: int = 0, limit: int = None):
+        re.compile(pattern, flags)
+        chunks = [items[i : i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        if not chunks:
+            return
+        results = self.get_pool().imap_unordered(search_chunk, [(pattern, flags, chunk) for chunk in chunks])
+        deadline = time.monotonic() + self.timeout
+        finished = 0
+        found = 0
+        try:
+            while finished < len(chunks):
+                try:
+                    keys = results.next(timeout=max(0, deadline - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    raise TimeoutError(f"The search took longer than {self.timeout:g} seconds and was stopped.")
+                finished += 1
+                for key in keys:
+                    yield key
+                    found += 1
+                    if limit is not None and found >= limit:
+                        return
+        finally:
+            if finished < len(chunks):
+                self.reset()
+
+
+def split_limit(args: tuple) -> tuple[tuple, int]:
+    '''Splits the optional trailing "--limit N" from the command arguments.'''
+    if len(args) >= 2 and args[-2] == '--limit':
+        if not args[-1].isdigit() or int(args[-1]) < 1:
+            raise ValueError("The limit should be a whole number of at least 1")
+        return args[:-2], int(args[-1])
+    return args, None
+
+
+executor = SearchExecutor()
@@ -1,6 +1,9 @@
-import re
+import heapq
+import json
+import os
 import shutil
 import sys
+import time
 from pathlib import Path
 
 import common
@@ -28,6 +31,98 @@ SORTING_DICT = {'images':['.jpeg', '.png', '.jpg', '.svg'],
                 ARCHIVES:['.zip', '.gz', '.tar'],
                 'other': []
 }
+INDEX_FILE = '.sort_index'
+PROGRESS_INTERVAL = 0.5
+SAMPLES_NUMBER = 5
+
+
+class SortIndex:
+    '''On-disk state of a sorted directory tree.
+
+    Keeps the mtime and the subfolders of every scanned folder, so the next run only lists the folders
+    that have changed since. The files in the sorting folders are never looked at again, their folders
+    are only listed to find the empty ones.
+    '''
+
+    def __init__(self, directory: Path, sorting_dictionary: dict) -> None:
+        self.directory = directory
+        self.sorting_dictionary = sorting_dictionary
+        self.dirs = {}
+        self.entry_counts = {}
+        self.touched = set()
+
+    def load(self) -> None:
+        try:
+            with open(self.directory/INDEX_FILE, 'r', encoding='utf-8') as fh:
+                dirs = json.load(fh)['dirs']
+            self.dirs = {str(folder): (int(mtime), [str(subfolder) for subfolder in subfolders]) for folder, (mtime, subfolders) in dirs.items()}
+        except (FileNotFoundError, ValueError, TypeError, KeyError, AttributeError):
+            self.dirs = {}
+
+    def save(self) -> None:
+        with open(self.directory/INDEX_FILE, 'w', encoding='utf-8') as fh:
+            json.dump({'dirs': self.dirs}, fh)
+
+    def relative(self, path) -> str:
+        return os.path.relpath(path, self.directory)
+
+    def scanned(self, folder: str, mtime: int, subfolders: list[str], entries_number: int) -> None:
+        self.dirs[folder] = (mtime, subfolders)
+        self.entry_counts[folder] = entries_number
+        self.touched.add(folder)
+
+    def in_sorting_folder(self, folder: str) -> bool:
+        return folder != '.' and Path(folder).parts[0] in self.sorting_dictionary
+
+    def add_dir(self, folder: str) -> None:
+        '''Registers a folder created by this run, the next run lists it.'''
+        self.dirs.setdefault(folder, (0, []))
+        parent = os.path.dirname(folder) or '.'
+        if parent in self.entry_counts:
+            self.entry_counts[parent] += 1
+        if parent in self.dirs and folder not in self.dirs[parent][1]:
+            self.dirs[parent][1].append(folder)
+            self.touched.add(parent)
+
+    def moved_into(self, folder: str) -> None:
+        self.touched.add(folder)
+
+    def remove_dir(self, folder: str) -> None:
+        self.dirs.pop(folder, None)
+        self.touched.discard(folder)
+        parent = os.path.dirname(folder) or '.'
+        if parent in self.dirs and folder in self.dirs[parent][1]:
+            self.dirs[parent][1].remove(folder)
+            self.touched.add(parent)
+
+    def only_own_changes(self, folder: str) -> bool:
+        '''Tells if the folder holds as many entries as this run left in it, so nothing was added since the scan.'''
+        if folder not in self.entry_counts:
+            return False
+        with os.scandir(self.directory/folder) as entries:
+            return sum(1 for _ in entries) == self.entry_counts[folder]
+
+    def refresh_dirs(self) -> None:
+        '''Stores the mtimes of the folders changed by this run, so the sorting itself doesn't trigger a rescan.
+
+        The new mtime is only taken when the folder holds exactly what this run left in it. Otherwise the mtime
+        of the scan is kept, so a file added to the folder while it was being sorted is found by the next run.
+        The sorting folders aren't counted again: nothing is sorted from them, so a change missed there
+        only leaves an empty folder for a later run.
+        '''
+        for folder in self.touched:
+            if folder not in self.dirs:
+                continue
+            try:
+                mtime = os.stat(self.directory/folder).st_mtime_ns
+            except FileNotFoundError:
+                self.dirs.pop(folder, None)
+                continue
+            scan_mtime, subfolders = self.dirs[folder]
+            if mtime != scan_mtime and (self.in_sorting_folder(folder) or self.only_own_changes(folder)):
+                self.dirs[folder] = (mtime, subfolders)
+        self.touched = set()
+
 
 def get_directory(path):
     try:
@@ -38,23 +133,90 @@ def get_directory(path):
         raise TypeError("Sorry, such directory doesn't exist")
     return directory
 
-def create_sorted_dict(sorting_dictionary: dict) -> dict:
-  """Function creates a dictionary for sorted files."""
+class SortStats:
+    '''Counters of a Sort run.
 
-  sorted_dict = {}
-  for key in sorting_dictionary.keys():
-    sorted_dict.update({key:([], set())})
-  return sorted_dict
+    Keeps only bounded aggregates per category: number of files, bytes moved, extentions
+    and the names of the few largest files, so the memory doesn't grow with the number of files.
+    '''
 
-def remove_empty_folders(directory: Path, sorting_dictionary: dict) -> None:
-    '''Removes any folders left after sorting (because they are empty).
-    
-  Ignores the hidden files.
+    def __init__(self, sorting_dictionary: dict) -> None:
+        self.categories = {key: {'files': 0, 'bytes': 0, 'extentions': set(), 'largest': []} for key in sorting_dictionary.keys()}
+        self.files = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def add(self, category: str, file: Path, size: int) -> None:
+        counters = self.categories[category]
+        counters['files'] += 1
+        counters['bytes'] += size
+        counters['extentions'].add(file.suffix)
+        if len(counters['largest']) < SAMPLES_NUMBER:
+            heapq.heappush(counters['largest'], (size, file.name))
+        else:
+            heapq.heappushpop(counters['largest'], (size, file.name))
+        self.files += 1
+        self.bytes += size
+
+    def files_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.files / elapsed if elapsed else 0.0
+
+    def progress(self) -> str:
+        categories = ', '.join(f"{key}: {counters['files']}" for key, counters in self.categories.items() if counters['files'])
+        return f'Sorted {self.files} files ({self.bytes} bytes), {self.files_per_second():.0f} files/sec. {categories}'
+
+    def report_progress(self, force: bool = False) -> None:
+        now = time.perf_counter()
+        if force or now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            print(f'\r{self.progress()}', end='', flush=True)
+
+    def summary(self) -> dict:
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'seconds': round(time.perf_counter() - self.started, 3),
+            'files_per_second': round(self.files_per_second(), 1),
+            'categories': {
+                key: {
+                    'files': counters['files'],
+                    'bytes': counters['bytes'],
+                    'extentions': sorted(counters['extentions']),
+                    'largest': [name for size, name in sorted(counters['largest'], reverse=True)],
+                }
+                for key, counters in self.categories.items()
+            },
+        }
+
+def remove_empty_folders(directory: Path, sorting_dictionary: dict, index: SortIndex) -> None:
+    '''Removes the folders left empty after sorting, at any depth.
+
+  Uses the entry counts collected by the scan and updated by the moves, so nothing is listed again.
+  Goes bottom-up, so a folder that only contained empty folders is removed too. A parent skipped by the scan
+  as unchanged is counted when its subfolder is removed, so it is removed as well if that left it empty.
+  The sorting folders themselves and folders with any files left (hidden or skipped ones included) are kept.
   '''
-    exclude = '|'.join(key for key in sorting_dictionary.keys())
-    for dir in directory.glob('*'):
-        if dir.is_dir() and not re.search(exclude, str(dir)):
-            shutil.rmtree(dir)
+    counts = index.entry_counts
+    pending = [(-len(Path(folder).parts), folder) for folder in counts]
+    heapq.heapify(pending)
+    while pending:
+        _, folder = heapq.heappop(pending)
+        if counts[folder] != 0 or folder == '.' or folder in sorting_dictionary:
+            continue
+        try:
+            os.rmdir(directory/folder)
+        except OSError:
+            continue
+        index.remove_dir(folder)
+        parent = os.path.dirname(folder) or '.'
+        if parent in counts:
+            counts[parent] -= 1
+        elif parent != '.' and parent not in sorting_dictionary:
+            with os.scandir(directory/parent) as entries:
+                counts[parent] = sum(1 for _ in entries)
+            heapq.heappush(pending, (-len(Path(parent).parts), parent))
 
 def rename_path(file, directory, category, i=0):
     category_folder = directory/category
@@ -71,52 +233,112 @@ def rename_path(file, directory, category, i=0):
     file.rename(new_file_path)
     return new_file_path
           
-def sort_and_move_files(directory: Path, sorting_dictionary: dict) -> None:
+def scan_new_files(directory: Path, sorting_dictionary: dict, index: SortIndex):
+    """Generator walks the directory tree and yields the files that have to be sorted.
+
+  Folders whose mtime hasn't changed since the last run aren't listed again, only their known subfolders are visited.
+  The sorting folders are only listed for the entry counts, no files are yielded from them.
+  """
+    stack = ['.']
+    while stack:
+        folder = stack.pop()
+        path = directory/folder
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            index.dirs.pop(folder, None)
+            continue
+        cached = index.dirs.get(folder)
+        if cached and cached[0] == mtime:
+            stack.extend(cached[1])
+            continue
+        subfolders = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                files.append(entry)
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(index.relative(entry.path))
+        index.scanned(folder, mtime, subfolders, len(files))
+        stack.extend(subfolders)
+        if index.in_sorting_folder(folder):
+            continue
+        for entry in files:
+            if entry.name == INDEX_FILE and folder == '.':
+                continue
+            if entry.is_file(follow_symlinks=False) and '.' in entry.name[1:]:
+                yield entry
+
+def sort_and_move_files(directory: Path, sorting_dictionary: dict, index: SortIndex) -> SortStats:
     """Function checks if a file belongs to any category in a sorting_dictionary and moves it to the sorting folder.
 
   If the file isn't in any category, moves to "other"
-  Returns a dictionary of sorted files and extentions.
+  Returns the SortStats of the moved files and prints the progress while sorting.
   """
-    sorted_dict = create_sorted_dict(sorting_dictionary)
-    exclude = '|'.join(key for key in sorting_dictionary.keys())
-    for file in directory.rglob('?*.*'):
-        if not re.search(exclude, str(file)):
-            transfer = False
-            for category, extentions in sorting_dictionary.items():
-                if file.suffix in extentions:
-                    file = rename_path(file, directory, category)
-                    stats(sorted_dict, category, file)
-                    transfer = True                
-            if transfer == False:
-                file = rename_path(file, directory, 'other')
-                stats(sorted_dict, 'other', file)
-    return sorted_dict
-
-def stats(sorted_dict, category, file_name):
-     sorted_dict[category][0].append(file_name.name)
-     sorted_dict[category][1].add(file_name.suffix)
-
-def unpack_archive_to_subfolder(directory: Path, archive_name: Path, extention: str) -> None:
+    sorted_stats = SortStats(sorting_dictionary)
+    category_folders = {category for category in sorting_dictionary if (directory/category).is_dir()}
+    for entry in scan_new_files(directory, sorting_dictionary, index):
+        file = Path(entry.path)
+        source_folder = index.relative(file.parent)
+        file_stat = entry.stat(follow_symlinks=False)
+        transfer = False
+        for category, extentions in sorting_dictionary.items():
+            if file.suffix in extentions:
+                file = rename_path(file, directory, category)
+                sorted_stats.add(category, file, file_stat.st_size)
+                transfer = True
+        if transfer == False:
+            file = rename_path(file, directory, 'other')
+            sorted_stats.add('other', file, file_stat.st_size)
+        category = file.parent.name
+        if category not in category_folders:
+            category_folders.add(category)
+            index.add_dir(category)
+        index.moved_into(category)
+        index.entry_counts[source_folder] -= 1
+        sorted_stats.report_progress()
+    sorted_stats.report_progress(force=True)
+    print()
+    return sorted_stats
+
+def unpack_archive_to_subfolder(directory: Path, archive_name: Path, extention: str) -> Path:
   folder_to_unpack = directory/archive_name.stem
   folder_to_unpack.mkdir()
   shutil.unpack_archive(archive_name, folder_to_unpack, extention)
+  return folder_to_unpack
 
-def unpack_archives_in_dir(archive_folder: Path, sorting_dictionary: dict) -> None:
+def unpack_archives_in_dir(archive_folder: Path, sorting_dictionary: dict) -> list[Path]:
+  '''Unpacks the archives to subfolders and returns the created subfolders.'''
+  unpacked = []
   for obj in archive_folder.glob('?*.*'):
     extention = obj.suffix
     if extention in sorting_dictionary[archive_folder.name]:
       extention = extention.split('.')[1]
       try:
-          unpack_archive_to_subfolder(archive_folder, obj, extention)
+          unpacked.append(unpack_archive_to_subfolder(archive_folder, obj, extention))
       except FileExistsError:
         print(f"This {obj} folder already exists")
       except shutil.ReadError:
         print("This archive couldn't be unpacked.")
+  return unpacked
+
+def sort_directory(directory: Path, sorting_dictionary: dict) -> SortStats:
+    """Sorts the files, removes empty folders, unpacks the archives and saves the index for the next run."""
+    index = SortIndex(directory, sorting_dictionary)
+    index.load()
+    sorted_stats = sort_and_move_files(directory, sorting_dictionary, index)
+    remove_empty_folders(directory, sorting_dictionary, index)
+    archive_folder = directory/ARCHIVES
+    for folder in unpack_archives_in_dir(archive_folder, sorting_dictionary):
+        index.add_dir(index.relative(folder))
+    index.refresh_dirs()
+    index.save()
+    return sorted_stats
 
 ui = UserInterfaceSort()
 
 def main():
-    '''Script renames the files, sorts the files in the given directory to folders specified as keys in a sorting dictionary, removes empty folders and prints the found files and their extentions by categories.
+    '''Script renames the files, sorts the files in the given directory to folders specified as keys in a sorting dictionary, removes empty folders and prints the progress and a JSON summary of the moved files by categories.
 
     By default it ignores the sorting folders.
     '''
@@ -135,12 +357,9 @@ def main():
             print(error)
             continue
 
-        sorted_dict = sort_and_move_files(directory, SORTING_DICT)
-        remove_empty_folders(directory, SORTING_DICT)
-        archive_folder = directory/ARCHIVES
-        unpack_archives_in_dir(archive_folder, SORTING_DICT)
+        sorted_stats = sort_directory(directory, SORTING_DICT)
         print(f'The folder {path} has been sorted.')
-        print(f'Found files and extentions: {sorted_dict}')
+        print(json.dumps(sorted_stats.summary(), indent=2))
 
 if __name__ == '__main__':
     main()